@@ -1,11 +1,124 @@
-from flask import Flask, jsonify, request
+from flask import Flask, request, Response
+import orjson
 import time
+import zlib
+from functools import lru_cache
 from database import DatabaseManager
+from swr_cache import SWRCache
 from vmc_commands import CommandBuilder
 
 app = Flask(__name__)
 db = DatabaseManager()
 
+def json_resp(obj, status=200):
+    """orjson-serialized JSON response; drop-in replacement for jsonify."""
+    return Response(orjson.dumps(obj), status=status, mimetype='application/json')
+
+@app.after_request
+def _keep_alive_hints(resp):
+    # Dashboard clients poll /api/status and /api/command/<id> every second;
+    # advertising keep-alive lets them reuse one TCP connection instead of
+    # paying a handshake per poll (gunicorn_conf.py keeps sockets open 65s).
+    resp.headers['Connection'] = 'keep-alive'
+    resp.headers['Keep-Alive'] = 'timeout=60, max=1000'
+    return resp
+
+# Dashboard endpoints change on VMC-report cadence (seconds), so serve
+# cached bytes and refresh in the background rather than hitting SQLite
+# and re-serializing per GET.
+swr = SWRCache(fresh_ttl=1.0, stale_ttl=10.0)
+
+# Argument-free payloads are constants — build them once at import instead
+# of re-running the builder on every request.
+CANCEL_HEX = CommandBuilder.cancel_transaction()
+SYNC_HEX = CommandBuilder.sync_info()
+
+# The daily-sales payload only changes once per day, so cache it keyed on
+# the current day bucket instead of calling strftime + builder per request.
+_daily_sales_cache = (None, None)
+
+def _daily_sales_payload():
+    global _daily_sales_cache
+    # Bucket on *local* days — strftime below is localtime, so the key
+    # must roll at local midnight too (tm_gmtoff also tracks DST shifts).
+    now = time.time()
+    day = int(now + time.localtime(now).tm_gmtoff) // 86400
+    if _daily_sales_cache[0] != day:
+        date_str = time.strftime("%Y%m%d")
+        _daily_sales_cache = (day, (date_str, CommandBuilder.query_daily_sales(date_str)))
+    return _daily_sales_cache[1]
+
+@lru_cache(maxsize=1024)
+def _drive_hex(selection):
+    # 06 + DropSensor(1) + Elevator(1) + Selection(2) + Cart(1)
+    return f"060101{selection:04X}00"
+
+# ==============================================================================
+#  SYNCHRONOUS MODE (?wait=true)
+# ==============================================================================
+
+def _wants_wait():
+    """Blocking mode is opt-in per request via ?wait=true."""
+    return request.args.get('wait', '').lower() in ('1', 'true', 'yes')
+
+def wait_for_command_result(cmd_id, timeout=300.0):
+    """
+    Blocks the HTTP request until the command is COMPLETED or FAILED.
+    This creates a 'Synchronous' feel for the API user.
+
+    Waits on the per-command Event signalled by db.update_command_result,
+    so completion wakes us immediately instead of being discovered up to
+    100ms later by polling. The serial controller normally runs in its own
+    process (where the Event never fires), so we still re-check the DB once
+    per second as a fallback — ~1 query/s instead of 10/s.
+    """
+    deadline = time.time() + timeout
+    evt = db.register_waiter(cmd_id)
+    conn = db.get_connection()
+
+    try:
+        while True:
+            cursor = conn.cursor()
+            cursor.execute("SELECT status, completion_details FROM command_queue WHERE id = ?", (cmd_id,))
+            row = cursor.fetchone()
+
+            if row:
+                status = row['status']
+                # We wait for a final state.
+                # 'ACKED' is not enough (it just means VMC heard us).
+                # We want 'COMPLETED' (VMC finished the job) or 'FAILED'.
+                if status in ('COMPLETED', 'FAILED'):
+                    return status, row['completion_details']
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return "TIMEOUT", None
+            evt.wait(min(1.0, remaining))
+    finally:
+        db.unregister_waiter(cmd_id)
+
+def execute_blocking_command(hex_payload, action_name):
+    """
+    Helper to Add Command -> Wait -> Return JSON
+    """
+    cmd_id = db.add_command(hex_payload)
+    status, details = wait_for_command_result(cmd_id)
+
+    if status == "TIMEOUT":
+        return json_resp({
+            "status": "timeout",
+            "error": "VMC did not respond in time",
+            "command_id": cmd_id,
+            "action": action_name
+        }, 504)
+
+    return json_resp({
+        "status": status,  # COMPLETED / FAILED
+        "command_id": cmd_id,
+        "action": action_name,
+        "result": details  # JSON data from the VMC (e.g. Sales Data)
+    }, 200)
+
 # ==============================================================================
 #  CORE VENDING OPERATIONS
 # ==============================================================================
@@ -20,19 +133,22 @@ def buy_product():
     selection = data.get('selection')
     
     if not selection:
-        return jsonify({"error": "Missing selection ID"}), 400
+        return json_resp({"error": "Missing selection ID"}, 400)
 
     # 1. Generate HEX for "Select to Buy"
     hex_payload = CommandBuilder.dispense(int(selection))
-    
+
+    if _wants_wait():
+        return execute_blocking_command(hex_payload, "DISPENSE")
+
     # 2. Add to Queue
     cmd_id = db.add_command(hex_payload)
-    
-    return jsonify({
+
+    return json_resp({
         "status": "accepted",
         "command_id": cmd_id,
         "message": "Purchase request queued. Poll /api/command/<id> for result."
-    }), 202
+    }, 202)
 
 @app.route('/api/drive', methods=['POST'])
 def drive_motor_direct():
@@ -44,20 +160,19 @@ def drive_motor_direct():
     data = request.json
     selection = data.get('selection')
     
-    # Payload: 06 + DropSensor(1) + Elevator(1) + Selection(2) + Cart(1)
-    # We construct this manually here or add helper in CommandBuilder
-    # Simple hex construction for 0x06:
     # 06 01(Sensor On) 01(Elevator On) [Selection] 00(No Cart)
-    sel_hex = f"{int(selection):04X}"
-    hex_payload = f"060101{sel_hex}00" 
-    
+    hex_payload = _drive_hex(int(selection))
+
+    if _wants_wait():
+        return execute_blocking_command(hex_payload, "DIRECT_DRIVE")
+
     cmd_id = db.add_command(hex_payload)
     
-    return jsonify({
+    return json_resp({
         "status": "accepted",
         "command_id": cmd_id,
         "type": "DIRECT_DRIVE"
-    }), 202
+    }, 202)
 
 # ==============================================================================
 #  PAYMENT & TRANSACTION CONTROL
@@ -73,12 +188,15 @@ def deduct_money():
     amount = data.get('amount')
     
     if amount is None or amount <= 0:
-        return jsonify({"error": "Invalid amount"}), 400
+        return json_resp({"error": "Invalid amount"}, 400)
 
     hex_payload = CommandBuilder.deduct_card(int(amount))
+
+    if _wants_wait():
+        return execute_blocking_command(hex_payload, "DEDUCT_MONEY")
+
     cmd_id = db.add_command(hex_payload)
-    
-    return jsonify({"status": "processing", "command_id": cmd_id}), 202
+    return json_resp({"status": "processing", "command_id": cmd_id}, 202)
 
 @app.route('/api/cancel', methods=['POST'])
 def cancel_transaction():
@@ -86,9 +204,11 @@ def cancel_transaction():
     Cancel Transaction (Command 0x64 with Amount 0).
     Usage: POST /api/cancel
     """
-    hex_payload = CommandBuilder.cancel_transaction()
-    cmd_id = db.add_command(hex_payload)
-    return jsonify({"status": "cancelling", "command_id": cmd_id}), 202
+    if _wants_wait():
+        return execute_blocking_command(CANCEL_HEX, "CANCEL_TRANSACTION")
+
+    cmd_id = db.add_command(CANCEL_HEX)
+    return json_resp({"status": "cancelling", "command_id": cmd_id}, 202)
 
 # ==============================================================================
 #  DATA & SYNCHRONIZATION
@@ -100,34 +220,59 @@ def force_sync():
     Trigger VMC to report all products (Command 0x31).
     The Serial Controller will catch the 0x11 responses and populate the 'products' table.
     """
-    hex_payload = CommandBuilder.sync_info()
-    cmd_id = db.add_command(hex_payload)
-    return jsonify({"status": "sync_started", "command_id": cmd_id}), 202
+    cmd_id = db.add_command(SYNC_HEX)
+    return json_resp({"status": "sync_started", "command_id": cmd_id}, 202)
+
+PRODUCT_COLS = ('selection_id', 'price', 'inventory', 'capacity',
+                'product_id', 'status', 'updated_at')
+
+def _build_products_body():
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    # Plain tuple rows: skip the sqlite3.Row wrapper on this bulk path.
+    cursor.row_factory = None
+    cursor.execute("""
+        SELECT selection_id, price, inventory, capacity, product_id, status, updated_at
+        FROM products ORDER BY selection_id ASC
+    """)
+    rows = cursor.fetchall()
+    return orjson.dumps({
+        "count": len(rows),
+        "products": [dict(zip(PRODUCT_COLS, row)) for row in rows],
+    })
+
+def _build_status_body():
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute("SELECT key, value FROM vmc_status")
+    return orjson.dumps(dict(cursor.fetchall()))
+
+def _cached_json(body):
+    """
+    Wraps a cached body with ETag revalidation: polling dashboards that
+    already hold the current bytes get an empty 304 instead of the full
+    payload. The tag is derived from the body itself (CRC32) rather than
+    the in-process version counters, because the serial controller writes
+    from a separate process where those counters never bump.
+    """
+    etag = f'W/"{zlib.crc32(body):08x}"'
+    if request.headers.get('If-None-Match') == etag:
+        return Response(status=304, headers={'ETag': etag})
+    return Response(body, mimetype='application/json', headers={'ETag': etag})
 
 @app.route('/api/products', methods=['GET'])
 def get_products():
     """
     Reads the 'products' table populated by the Serial Controller.
-    Returns: JSON list of inventory/prices.
+    Returns: JSON list of inventory/prices (SWR-cached, ETag-revalidated).
     """
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM products ORDER BY selection_id ASC")
-    rows = cursor.fetchall()
-    
-    products = [dict(row) for row in rows]
-    return jsonify({"count": len(products), "products": products})
+    return _cached_json(swr.get('products', _build_products_body, db.products_version))
 
 @app.route('/api/status', methods=['GET'])
 def get_machine_status():
-    """Returns VMC status (Temp, Door, Balance) from DB."""
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM vmc_status")
-    rows = cursor.fetchall()
-    
-    status = {row['key']: row['value'] for row in rows}
-    return jsonify(status)
+    """Returns VMC status (Temp, Door, Balance) from DB (SWR-cached, ETag-revalidated)."""
+    return _cached_json(swr.get('status', _build_status_body, db.status_version))
 
 # ==============================================================================
 #  COMMAND POLLING (The "Are we there yet?" endpoint)
@@ -142,11 +287,16 @@ def check_command_status(cmd_id):
     cursor = conn.cursor()
     cursor.execute("SELECT status, response_payload, completion_details FROM command_queue WHERE id = ?", (cmd_id,))
     row = cursor.fetchone()
-    
+
     if not row:
-        return jsonify({"error": "Command not found"}), 404
+        # Finished commands are eventually swept off the hot table — fall
+        # back to the archive before declaring the id unknown.
+        row = db.get_archived_command(cmd_id)
+
+    if not row:
+        return json_resp({"error": "Command not found"}, 404)
     
-    return jsonify({
+    return json_resp({
         "id": cmd_id,
         "status": row['status'], # PENDING, SENDING, DISPENSING, COMPLETED, FAILED
         "details": row['completion_details'] # JSON string from Serial Controller
@@ -165,10 +315,15 @@ def set_product_price():
     price = data.get('price')
     
     if sel is None or price is None:
-        return jsonify({"error": "Missing selection or price"}), 400
+        return json_resp({"error": "Missing selection or price"}, 400)
     
-    cmd_id = db.add_command(CommandBuilder.set_price(int(sel), int(price)))
-    return jsonify({"status": "queued", "command_id": cmd_id, "action": "SET_PRICE"}), 202
+    hex_payload = CommandBuilder.set_price(int(sel), int(price))
+
+    if _wants_wait():
+        return execute_blocking_command(hex_payload, "SET_PRICE")
+
+    cmd_id = db.add_command(hex_payload)
+    return json_resp({"status": "queued", "command_id": cmd_id, "action": "SET_PRICE"}, 202)
 
 @app.route('/api/products/inventory', methods=['POST'])
 def set_product_inventory():
@@ -181,10 +336,15 @@ def set_product_inventory():
     inv = data.get('inventory')
     
     if sel is None or inv is None:
-        return jsonify({"error": "Missing selection or inventory"}), 400
+        return json_resp({"error": "Missing selection or inventory"}, 400)
     
-    cmd_id = db.add_command(CommandBuilder.set_inventory(int(sel), int(inv)))
-    return jsonify({"status": "queued", "command_id": cmd_id, "action": "SET_INVENTORY"}), 202
+    hex_payload = CommandBuilder.set_inventory(int(sel), int(inv))
+
+    if _wants_wait():
+        return execute_blocking_command(hex_payload, "SET_INVENTORY")
+
+    cmd_id = db.add_command(hex_payload)
+    return json_resp({"status": "queued", "command_id": cmd_id, "action": "SET_INVENTORY"}, 202)
 
 @app.route('/api/config/selection/<int:selection_id>', methods=['GET'])
 def query_selection_config(selection_id):
@@ -192,18 +352,26 @@ def query_selection_config(selection_id):
     Triggers a live query (0x42) to get the config from the VMC.
     Returns the command ID to poll.
     """
-    cmd_id = db.add_command(CommandBuilder.query_selection_config(selection_id))
-    return jsonify({"status": "queued", "command_id": cmd_id, "action": "QUERY_CONFIG"}), 202
+    hex_payload = CommandBuilder.query_selection_config(selection_id)
+
+    if _wants_wait():
+        return execute_blocking_command(hex_payload, "QUERY_CONFIG")
+
+    cmd_id = db.add_command(hex_payload)
+    return json_resp({"status": "queued", "command_id": cmd_id, "action": "QUERY_CONFIG"}, 202)
 
 @app.route('/api/sales/daily', methods=['GET'])
 def query_daily_sales():
     """
     Triggers a query for today's sales (0x43).
     """
-    # Format YYYYMMDD
-    today_str = time.strftime("%Y%m%d")
-    cmd_id = db.add_command(CommandBuilder.query_daily_sales(today_str))
-    return jsonify({"status": "queued", "command_id": cmd_id, "action": "QUERY_SALES", "date": today_str}), 202
+    today_str, payload = _daily_sales_payload()
+
+    if _wants_wait():
+        return execute_blocking_command(payload, "QUERY_SALES")
+
+    cmd_id = db.add_command(payload)
+    return json_resp({"status": "queued", "command_id": cmd_id, "action": "QUERY_SALES", "date": today_str}, 202)
 
 
 # ==============================================================================
@@ -211,7 +379,9 @@ def query_daily_sales():
 # ==============================================================================
 
 if __name__ == '__main__':
-    # Initialize DB if running standalone
+    # Standalone fallback only — deploy under gunicorn (see gunicorn_conf.py)
+    # so requests are served by a threaded worker pool instead of the
+    # single-threaded Werkzeug dev server.
     print("🚀 Middleware API Starting on Port 5000...")
     print("Ensure 'serial_controller.py' is running in a separate terminal!")
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    app.run(host='0.0.0.0', port=5000)
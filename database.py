@@ -1,24 +1,94 @@
 import sqlite3
-import json
+import orjson
 import os
 import time
+import queue
+import threading
+import logging
+from contextlib import contextmanager
 
 DB_NAME = "vmc_middleware.db"
 
+_log = logging.getLogger(__name__)
+
+# How many command ids to claim from sqlite_sequence per reservation.
+ID_RESERVE_BLOCK = 1000
+
+# Archiver cadence: move finished commands off the hot table every 5 min
+# once they have been final for an hour.
+ARCHIVE_INTERVAL_SECS = 300
+ARCHIVE_AFTER_SECS = 3600
+
+# Max inserts folded into one transaction by the writer thread.
+MAX_WRITE_BATCH = 64
+
+# Drop fire-and-forget event logs beyond this backlog instead of stalling
+# the serial loop; event_log is diagnostic, not correctness-critical.
+EVENT_BACKLOG_MAX = 4096
+
 class DatabaseManager:
     def __init__(self, db_path=DB_NAME):
         self.db_path = db_path
+        self._local = threading.local()
+        # Per-command completion events. Waiting HTTP handlers register here
+        # and update_command_result() signals them, so waiters wake on the
+        # state change instead of rediscovering it by polling.
+        self._waiters = {}
+        self._waiters_lock = threading.Lock()
+        # Bumped on in-process writes so response caches can invalidate
+        # early instead of waiting out their TTL.
+        self.products_version = 0
+        self.status_version = 0
         self._init_db()
+        # Write-batcher: inserts from concurrent HTTP handlers and fire-and-
+        # forget event logs are funnelled through one thread so a burst of
+        # writes pays one commit/fsync per batch instead of one per call.
+        self._write_q = queue.Queue()
+        self._event_backlog = 0
+        # Pre-reserved AUTOINCREMENT id range (claimed lazily on the first
+        # add_command) so ids can be handed out without touching the DB.
+        self._id_lock = threading.Lock()
+        self._next_id = None
+        self._id_limit = 0
+        self._writer = threading.Thread(target=self._writer_loop, daemon=True)
+        self._writer.start()
+        # Archiver: periodically sweeps finished commands and old events
+        # into the *_archive tables so the hot tables stay cache-resident.
+        self._archiver = threading.Thread(target=self._archiver_loop, daemon=True)
+        self._archiver.start()
 
     def get_connection(self):
-        conn = sqlite3.connect(self.db_path, timeout=10.0)
-        conn.row_factory = sqlite3.Row
+        """
+        Returns a long-lived connection cached per thread.
+        Opening a fresh sqlite3 connection per call was the single biggest
+        latency cost on every endpoint and every serial-loop tick, so each
+        worker thread opens once and reuses it for the process lifetime.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # cached_statements keeps each hot-path SQL string compiled once
+            # per connection instead of reparsing per call. check_same_thread
+            # is safe to drop because connections are thread-local anyway.
+            conn = sqlite3.connect(
+                self.db_path, timeout=10.0,
+                cached_statements=256, check_same_thread=False,
+            )
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL;")
+            # Per-connection tuning (these do not persist in the DB file):
+            # NORMAL is durable enough under WAL and halves fsync frequency;
+            # the rest keep hot pages and temp data in memory and let reads
+            # go through mmap instead of read() syscalls.
+            conn.execute("PRAGMA synchronous=NORMAL;")
+            conn.execute("PRAGMA cache_size=-16000;")      # 16 MB page cache
+            conn.execute("PRAGMA temp_store=MEMORY;")
+            conn.execute("PRAGMA mmap_size=268435456;")    # 256 MB
+            conn.execute("PRAGMA busy_timeout=30000;")
+            self._local.conn = conn
         return conn
 
     def _init_db(self):
         with self.get_connection() as conn:
-            conn.execute("PRAGMA journal_mode=WAL;")
-            
             # 1. Command Queue
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS command_queue (
@@ -29,10 +99,17 @@ class DatabaseManager:
                     assigned_pack_no INTEGER,
                     response_payload TEXT,
                     completion_details TEXT,
-                    created_at REAL DEFAULT (datetime('now', 'localtime')),
-                    updated_at REAL DEFAULT (datetime('now', 'localtime'))
+                    created_at REAL DEFAULT (strftime('%s','now')),
+                    updated_at REAL DEFAULT (strftime('%s','now')),
+                    command_bytes BLOB
                 );
             """)
+            # Pre-existing DBs predate command_bytes; ALTER appends it, so
+            # the column sits last in both old and fresh schemas.
+            try:
+                conn.execute("ALTER TABLE command_queue ADD COLUMN command_bytes BLOB")
+            except sqlite3.OperationalError:
+                pass
 
             # 2. VMC Status
             conn.execute("""
@@ -40,7 +117,7 @@ class DatabaseManager:
                     key TEXT PRIMARY KEY,
                     value TEXT,
                     raw_hex TEXT,
-                    updated_at REAL DEFAULT (datetime('now', 'localtime'))
+                    updated_at REAL DEFAULT (strftime('%s','now'))
                 );
             """)
 
@@ -51,7 +128,7 @@ class DatabaseManager:
                     event_type TEXT,
                     raw_data TEXT,
                     parsed_data TEXT,
-                    created_at REAL DEFAULT (datetime('now', 'localtime'))
+                    created_at REAL DEFAULT (strftime('%s','now'))
                 );
             """)
 
@@ -64,7 +141,7 @@ class DatabaseManager:
                     capacity INTEGER,
                     product_id INTEGER,               -- Internal VMC PID
                     status INTEGER,                   -- 0=Normal, 1=Paused
-                    updated_at REAL DEFAULT (datetime('now', 'localtime'))
+                    updated_at REAL DEFAULT (strftime('%s','now'))
                 );
             """)
 
@@ -77,97 +154,399 @@ class DatabaseManager:
                     packet_type TEXT,      -- 'POLL', 'ACK', 'CMD', 'DATA', 'UNKNOWN'
                     raw_hex TEXT,          -- Full packet hex including STX/CRC
                     parsed_details TEXT,   -- Optional JSON breakdown
-                    created_at REAL DEFAULT (datetime('now', 'localtime'))
+                    created_at REAL DEFAULT (strftime('%s','now'))
+                );
+            """)
+            # updated_at is maintained by triggers so application UPDATEs
+            # stay short (fewer distinct SQL texts -> better statement-cache
+            # hit rate). recursive_triggers is off by default, so the inner
+            # UPDATE does not re-fire the trigger.
+            conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS trg_cq_touch AFTER UPDATE ON command_queue
+                BEGIN
+                    UPDATE command_queue SET updated_at=strftime('%s','now') WHERE id=NEW.id;
+                END;
+            """)
+            conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS trg_status_touch AFTER UPDATE ON vmc_status
+                BEGIN
+                    UPDATE vmc_status SET updated_at=strftime('%s','now') WHERE key=NEW.key;
+                END;
+            """)
+            conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS trg_products_touch AFTER UPDATE ON products
+                BEGIN
+                    UPDATE products SET updated_at=strftime('%s','now') WHERE selection_id=NEW.selection_id;
+                END;
+            """)
+            # Cold storage for finished commands and old events. The
+            # archiver thread moves rows here so the hot tables stay small
+            # enough to live entirely in the page cache. id stays the
+            # PRIMARY KEY, which is the index check_command_status needs.
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS command_queue_archive (
+                    id INTEGER PRIMARY KEY,
+                    command_hex TEXT NOT NULL,
+                    status TEXT,
+                    retry_count INTEGER,
+                    assigned_pack_no INTEGER,
+                    response_payload TEXT,
+                    completion_details TEXT,
+                    created_at REAL,
+                    updated_at REAL,
+                    command_bytes BLOB
+                );
+            """)
+            try:
+                conn.execute("ALTER TABLE command_queue_archive ADD COLUMN command_bytes BLOB")
+            except sqlite3.OperationalError:
+                pass
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS event_log_archive (
+                    id INTEGER PRIMARY KEY,
+                    event_type TEXT,
+                    raw_data TEXT,
+                    parsed_data TEXT,
+                    created_at REAL
                 );
             """)
+            # Indexes for the serial controller's hot queue scan.
+            # The partial index only covers the handful of active rows, so it
+            # stays tiny no matter how much history command_queue accumulates.
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_cq_status_id
+                ON command_queue(status, id);
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_cq_active
+                ON command_queue(id) WHERE status IN ('PENDING', 'SENDING');
+            """)
+            conn.commit()
+
+    # --- Write batching ---
+
+    def _commit(self, conn):
+        """Commit now, unless the calling thread is inside batch()."""
+        if not getattr(self._local, 'in_batch', False):
             conn.commit()
 
+    @contextmanager
+    def batch(self):
+        """
+        Folds every write made inside the block into one transaction —
+        one commit (one fsync) instead of one per call. Used by the serial
+        controller when a single packet triggers several table updates.
+
+        Waiter notifications raised inside the block are held back and
+        fired only after the commit succeeds — an Event must never be set
+        while its row is still invisible to other connections (and never
+        at all if the batch rolls back).
+        """
+        conn = self.get_connection()
+        self._local.in_batch = True
+        self._local.pending_notifies = []
+        try:
+            yield
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            self._local.pending_notifies = []
+            raise
+        finally:
+            self._local.in_batch = False
+        pending, self._local.pending_notifies = self._local.pending_notifies, []
+        for cmd_id in pending:
+            self._notify_waiter(cmd_id)
+
     # --- Command Management ---
 
+    def _reserve_id_block(self):
+        """
+        Atomically claims ID_RESERVE_BLOCK ids by advancing the
+        command_queue entry in sqlite_sequence. Safe against other
+        processes: the bump happens under an IMMEDIATE transaction, and the
+        VMC's own AUTOINCREMENT inserts continue above the claimed range.
+        """
+        conn = self.get_connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT seq FROM sqlite_sequence WHERE name='command_queue'").fetchone()
+            seq = row[0] if row else 0
+            new_seq = seq + ID_RESERVE_BLOCK
+            if row:
+                conn.execute(
+                    "UPDATE sqlite_sequence SET seq=? WHERE name='command_queue'", (new_seq,))
+            else:
+                conn.execute(
+                    "INSERT INTO sqlite_sequence (name, seq) VALUES ('command_queue', ?)", (new_seq,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return seq + 1, new_seq
+
     def add_command(self, command_hex):
         """
         Adds a new command to the queue.
         Required by Flask endpoints to insert commands.
+
+        Write-behind: the id comes from a pre-reserved range so the caller
+        gets it immediately; the actual INSERT is performed shortly after by
+        the writer thread. Status polls for an id the writer has not flushed
+        yet simply see "not found" for a few milliseconds.
         """
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO command_queue (command_hex, status)
-                VALUES (?, 'PENDING')
-            """, (command_hex,))
+        with self._id_lock:
+            if self._next_id is None or self._next_id > self._id_limit:
+                self._next_id, self._id_limit = self._reserve_id_block()
+            cmd_id = self._next_id
+            self._next_id += 1
+        # Decode once at enqueue so the serial loop never pays a per-POLL
+        # bytes.fromhex on the queue's hot path.
+        self._write_q.put(('cmd', (cmd_id, command_hex, bytes.fromhex(command_hex))))
+        return cmd_id
+
+    def _writer_loop(self):
+        """
+        Drains queued writes (command inserts and async event logs) and
+        commits them in batches of up to MAX_WRITE_BATCH under one
+        transaction — N writes, one fsync.
+        """
+        while True:
+            batch = [self._write_q.get()]
+            while len(batch) < MAX_WRITE_BATCH:
+                try:
+                    batch.append(self._write_q.get_nowait())
+                except queue.Empty:
+                    break
+
+            commands = [item for kind, item in batch if kind == 'cmd']
+            events = [item for kind, item in batch if kind == 'event']
+            if events:
+                self._event_backlog -= len(events)
+
+            conn = self.get_connection()
+            try:
+                cursor = conn.cursor()
+                if commands:
+                    # ids were pre-reserved by add_command, so the whole
+                    # batch is a single executemany with explicit ids.
+                    cursor.executemany(self._CMD_INSERT_SQL, commands)
+                if events:
+                    cursor.executemany(self._EVENT_INSERT_SQL, events)
+                conn.commit()
+            except Exception:
+                # Write-behind: callers were already answered (202s for the
+                # command ids), so there is nothing to raise into — but the
+                # rows must not vanish silently. Retry one-by-one so a
+                # single bad row discards only itself.
+                conn.rollback()
+                _log.exception("Write-behind flush failed (%d commands, %d events); retrying per row",
+                               len(commands), len(events))
+                self._flush_rows_individually(conn, commands, events)
+
+    _CMD_INSERT_SQL = """
+        INSERT INTO command_queue (id, command_hex, command_bytes, status)
+        VALUES (?, ?, ?, 'PENDING')
+    """
+    _EVENT_INSERT_SQL = "INSERT INTO event_log (event_type, raw_data, parsed_data) VALUES (?, ?, ?)"
+
+    def _flush_rows_individually(self, conn, commands, events):
+        """Salvage path for a failed batch flush: per-row transactions,
+        logging (not re-raising) each row that still fails."""
+        for sql, rows in ((self._CMD_INSERT_SQL, commands),
+                          (self._EVENT_INSERT_SQL, events)):
+            for row in rows:
+                try:
+                    conn.execute(sql, row)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    _log.exception("Dropping unwritable row: %r", row)
+
+    def _archiver_loop(self):
+        while True:
+            time.sleep(ARCHIVE_INTERVAL_SECS)
+            try:
+                self.archive_finished()
+            except Exception:
+                # Transient lock contention just means this sweep is skipped;
+                # the next one picks the rows up.
+                pass
+
+    def archive_finished(self, older_than=ARCHIVE_AFTER_SECS):
+        """
+        Moves COMPLETED/FAILED commands (and event_log rows) older than
+        `older_than` seconds into the archive tables, then truncates the
+        WAL. Keeping command_queue down to the active working set keeps its
+        btrees shallow and small enough to fit in cache_size.
+        """
+        cutoff = time.time() - older_than
+        conn = self.get_connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("""
+                INSERT OR IGNORE INTO command_queue_archive
+                SELECT * FROM command_queue
+                WHERE status IN ('COMPLETED', 'FAILED') AND updated_at < ?
+            """, (cutoff,))
+            conn.execute("""
+                DELETE FROM command_queue
+                WHERE status IN ('COMPLETED', 'FAILED') AND updated_at < ?
+            """, (cutoff,))
+            conn.execute("""
+                INSERT OR IGNORE INTO event_log_archive
+                SELECT * FROM event_log WHERE created_at < ?
+            """, (cutoff,))
+            conn.execute("DELETE FROM event_log WHERE created_at < ?", (cutoff,))
             conn.commit()
-            return cursor.lastrowid
+        except Exception:
+            conn.rollback()
+            raise
+        # Reclaim the WAL now that the bulk delete has been checkpointed out.
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+
+    def get_archived_command(self, cmd_id):
+        """Point lookup in the archive for status polls on old commands."""
+        with self.get_connection() as conn:
+            row = conn.execute(
+                "SELECT * FROM command_queue_archive WHERE id=?", (cmd_id,)).fetchone()
+            return dict(row) if row else None
 
     def get_next_command(self):
+        # Two indexed point-lookups (SENDING first for in-flight retries,
+        # then oldest PENDING) instead of a CASE-ordered scan of the table.
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("""
-                SELECT * FROM command_queue 
-                WHERE status IN ('PENDING', 'SENDING')
-                ORDER BY CASE WHEN status = 'SENDING' THEN 1 ELSE 2 END, id ASC
+                SELECT * FROM (
+                    SELECT * FROM command_queue WHERE status='SENDING' ORDER BY id LIMIT 1
+                )
+                UNION ALL
+                SELECT * FROM (
+                    SELECT * FROM command_queue WHERE status='PENDING' ORDER BY id LIMIT 1
+                )
                 LIMIT 1
             """)
             row = cursor.fetchone()
             return dict(row) if row else None
 
     def mark_as_sending(self, cmd_id, pack_no):
-        with self.get_connection() as conn:
-            conn.execute("UPDATE command_queue SET status='SENDING', assigned_pack_no=?, updated_at=datetime('now') WHERE id=?", (pack_no, cmd_id))
-            conn.commit()
+        conn = self.get_connection()
+        conn.execute("UPDATE command_queue SET status='SENDING', assigned_pack_no=? WHERE id=?", (pack_no, cmd_id))
+        self._commit(conn)
 
     def update_command_result(self, cmd_id, status, response_hex=None, details_dict=None):
-        details_json = json.dumps(details_dict) if details_dict else None
-        with self.get_connection() as conn:
-            conn.execute("""
-                UPDATE command_queue 
-                SET status=?, response_payload=?, completion_details=?, updated_at=datetime('now')
-                WHERE id=?
-            """, (status, response_hex, details_json, cmd_id))
-            conn.commit()
+        # Fast path: most results carry no details — skip the serializer.
+        details_json = orjson.dumps(details_dict).decode() if details_dict else None
+        conn = self.get_connection()
+        conn.execute("""
+            UPDATE command_queue
+            SET status=?, response_payload=?, completion_details=?
+            WHERE id=?
+        """, (status, response_hex, details_json, cmd_id))
+        self._commit(conn)
+        if status in ('COMPLETED', 'FAILED'):
+            self._notify_waiter(cmd_id)
+
+    # --- Completion Notification ---
+    #
+    # An SQLite update hook on command_queue would let waiters be signalled
+    # without the explicit _notify_waiter call, but the stdlib sqlite3
+    # binding does not expose set_update_hook, and even under apsw the hook
+    # is per-connection: it only fires for writes made through that same
+    # connection, so it could never observe the serial controller's updates
+    # (separate connection, usually a separate process). The explicit
+    # notify-after-commit below is therefore the reliable mechanism.
+
+    def register_waiter(self, cmd_id):
+        """
+        Returns a threading.Event that fires when cmd_id reaches a final
+        state (COMPLETED/FAILED). Only signals when the serial controller
+        shares this DatabaseManager instance (same process) — callers must
+        still re-check the row on timeout to cover the separate-process
+        deployment.
+        """
+        with self._waiters_lock:
+            evt = self._waiters.get(cmd_id)
+            if evt is None:
+                evt = self._waiters[cmd_id] = threading.Event()
+            return evt
+
+    def unregister_waiter(self, cmd_id):
+        with self._waiters_lock:
+            self._waiters.pop(cmd_id, None)
+
+    def _notify_waiter(self, cmd_id):
+        # Inside batch() the row is not committed yet — park the id for
+        # batch() to fire after its commit.
+        if getattr(self._local, 'in_batch', False):
+            self._local.pending_notifies.append(cmd_id)
+            return
+        with self._waiters_lock:
+            evt = self._waiters.get(cmd_id)
+        if evt:
+            evt.set()
 
     def increment_retry(self, cmd_id, current_retries):
         new_count = current_retries + 1
         status = 'FAILED' if new_count >= 5 else 'SENDING'
-        with self.get_connection() as conn:
-            conn.execute("UPDATE command_queue SET retry_count=?, status=?, updated_at=datetime('now') WHERE id=?", (new_count, status, cmd_id))
-            conn.commit()
+        conn = self.get_connection()
+        conn.execute("UPDATE command_queue SET retry_count=?, status=? WHERE id=?", (new_count, status, cmd_id))
+        self._commit(conn)
         return status
 
     # --- Data & Products ---
 
-    def upsert_product(self, data):
+    def upsert_product(self, report):
         """
         Updates a product slot from a 0x11 report.
-        data: {selection, price, inventory, capacity, product_id, status}
+        report: ProductReport(selection, price, inventory, capacity,
+        product_id, status) — bound positionally, field order matters.
         """
-        with self.get_connection() as conn:
-            conn.execute("""
-                INSERT INTO products (selection_id, price, inventory, capacity, product_id, status, updated_at)
-                VALUES (:selection, :price, :inventory, :capacity, :product_id, :status, datetime('now'))
-                ON CONFLICT(selection_id) DO UPDATE SET
-                    price=excluded.price,
-                    inventory=excluded.inventory,
-                    capacity=excluded.capacity,
-                    product_id=excluded.product_id,
-                    status=excluded.status,
-                    updated_at=excluded.updated_at
-            """, data)
-            conn.commit()
+        conn = self.get_connection()
+        conn.execute("""
+            INSERT INTO products (selection_id, price, inventory, capacity, product_id, status)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(selection_id) DO UPDATE SET
+                price=excluded.price,
+                inventory=excluded.inventory,
+                capacity=excluded.capacity,
+                product_id=excluded.product_id,
+                status=excluded.status
+        """, tuple(report))
+        self._commit(conn)
+        self.products_version += 1
 
     def update_machine_status(self, key, value, raw_hex=None):
-        with self.get_connection() as conn:
-            conn.execute("""
-                INSERT INTO vmc_status (key, value, raw_hex, updated_at)
-                VALUES (?, ?, ?, datetime('now'))
-                ON CONFLICT(key) DO UPDATE SET value=excluded.value, raw_hex=excluded.raw_hex, updated_at=excluded.updated_at
-            """, (key, str(value), raw_hex))
-            conn.commit()
+        conn = self.get_connection()
+        conn.execute("""
+            INSERT INTO vmc_status (key, value, raw_hex)
+            VALUES (?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET value=excluded.value, raw_hex=excluded.raw_hex
+        """, (key, str(value), raw_hex))
+        self._commit(conn)
+        self.status_version += 1
 
     def log_event(self, event_type, raw_data, parsed_dict=None):
-        parsed_json = json.dumps(parsed_dict) if parsed_dict else ""
-        with self.get_connection() as conn:
-            conn.execute("INSERT INTO event_log (event_type, raw_data, parsed_data) VALUES (?, ?, ?)", (event_type, raw_data, parsed_json))
-            conn.commit()
+        # NULL instead of the old "" sentinel when there is nothing to store.
+        parsed_json = orjson.dumps(parsed_dict).decode() if parsed_dict else None
+        conn = self.get_connection()
+        conn.execute("INSERT INTO event_log (event_type, raw_data, parsed_data) VALUES (?, ?, ?)", (event_type, raw_data, parsed_json))
+        self._commit(conn)
+
+    def log_event_async(self, event_type, raw_data, parsed_dict=None):
+        """
+        Fire-and-forget variant of log_event: hands the insert to the writer
+        thread so the caller (the serial loop) never waits on a commit.
+        Events past EVENT_BACKLOG_MAX are dropped rather than stalling the
+        protocol — a short durability window is acceptable for diagnostics.
+        """
+        if self._event_backlog >= EVENT_BACKLOG_MAX:
+            return
+        parsed_json = orjson.dumps(parsed_dict).decode() if parsed_dict else None
+        self._event_backlog += 1
+        self._write_q.put(('event', (event_type, raw_data, parsed_json)))
 
     # --- Full Traffic Tracing ---
 
@@ -177,13 +556,13 @@ class DatabaseManager:
         direction: 'IN' or 'OUT'
         packet_type: 'POLL', 'ACK', 'CMD', 'DATA', 'UNKNOWN'
         """
-        details_json = json.dumps(parsed_details) if parsed_details else None
-        with self.get_connection() as conn:
-            conn.execute("""
-                INSERT INTO packet_log (direction, packet_type, raw_hex, parsed_details)
-                VALUES (?, ?, ?, ?)
-            """, (direction, packet_type, raw_hex, details_json))
-            conn.commit()
+        details_json = orjson.dumps(parsed_details).decode() if parsed_details else None
+        conn = self.get_connection()
+        conn.execute("""
+            INSERT INTO packet_log (direction, packet_type, raw_hex, parsed_details)
+            VALUES (?, ?, ?, ?)
+        """, (direction, packet_type, raw_hex, details_json))
+        self._commit(conn)
 
 if __name__ == "__main__":
     db = DatabaseManager()
@@ -0,0 +1,23 @@
+"""
+Gunicorn configuration for the middleware API.
+
+Run with:  gunicorn -c gunicorn_conf.py app:app
+
+The Werkzeug dev server handles one request at a time; under gthread
+workers many clients can poll /api/command/<id> and block in
+wait_for_command_result concurrently. DatabaseManager already keeps one
+SQLite connection per thread, so threads never share a connection.
+"""
+import multiprocessing
+
+bind = "0.0.0.0:5000"
+workers = multiprocessing.cpu_count()
+worker_class = "gthread"
+threads = 32
+
+# Dashboard clients poll every second — keep their TCP connections open
+# between polls instead of re-accepting.
+keepalive = 65
+
+# Note: if switching worker_class to gevent, monkey-patch before sqlite3
+# is imported or the thread-local connection cache misbehaves.
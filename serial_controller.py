@@ -1,223 +1,460 @@
+"""
+Canonical VMC serial daemon — the single VMCController implementation.
+
+Earlier iterations of this controller lived in sibling modules (last one
+removed with new.py); all protocol or performance fixes belong here, with
+per-command behavior extended via the self._parsers registry rather than
+by forking the module.
+"""
+import os
+import selectors
 import serial
 import time
 import struct
 import logging
 import json
+import queue
+import threading
+from collections import deque
+from functools import lru_cache
 from database import DatabaseManager
-from vmc_commands import ResponseParser, CMD_REPORT_PRODUCT
+from vmc_commands import parse_product_report, parse_0x71_generic, CMD_REPORT_PRODUCT
 
 # --- Configuration ---
 SERIAL_PORT = '/dev/ttyS1' 
 BAUD_RATE = 57600
 TIMEOUT = 0.1 
+# Idle wait between selector wakeups; data arrival interrupts it, so this
+# only bounds how often a silent line wakes the loop (~1/s instead of 10/s).
+IDLE_SELECT_TIMEOUT = 1.0
+# How often the prefetcher re-checks SQLite for queued commands.
+QUEUE_PREFETCH_INTERVAL = 0.05
 
 # --- Protocol Constants ---
 STX = b'\xFA\xFB'
 CMD_POLL = 0x41
 CMD_ACK = 0x42
-CMD_MACHINE_STATUS = 0x52 
+CMD_MACHINE_STATUS = 0x52
 CMD_GENERIC_RETURN = 0x71
 
+# bytes.hex() always emits lowercase; translating the six letters in one
+# C-level pass is cheaper than .upper() re-walking the whole string.
+_HEX_UPPER_TBL = bytes.maketrans(b'abcdef', b'ABCDEF')
+
+def _hex_upper(data):
+    return data.hex().encode('ascii').translate(_HEX_UPPER_TBL).decode('ascii')
+
+# Fixed-shape data bodies decoded in one compiled unpack instead of a
+# slice-and-int.from_bytes per field.
+# 0x52: bill/coin/card/temp-ctrl/temperature/door + changer totals + id
+_STATUS_STRUCT = struct.Struct('>6BII10s')
+# 0x21: payment mode + amount
+_MONEY_STRUCT = struct.Struct('>BI')
+
+# 0x04 dispense status codes, precomputed for O(1) membership checks
+# (the old inline lists were rebuilt and scanned on every packet).
+_DISPENSE_SUCCESS = frozenset((0x02, 0x24))
+_DISPENSE_INTERMEDIATE = frozenset((0x01, 0x10, 0x11, 0x12, 0x13))
+
+def _checksum(data):
+    # Load the whole packet as one big int and XOR-fold it in halves:
+    # byte-wise XOR is associative/commutative, so folding at any byte
+    # boundary preserves the result. int.from_bytes runs in C, and a
+    # packet of n bytes then needs only ~log2(n) Python-level XORs
+    # instead of one per byte (or per 8-byte word).
+    n = len(data)
+    acc = int.from_bytes(data, 'little')
+    while n > 1:
+        h = (n + 1) >> 1
+        acc = (acc >> (h << 3)) ^ (acc & ((1 << (h << 3)) - 1))
+        n = h
+    return acc & 0xFF
+
+@lru_cache(maxsize=512)
+def _build_frame(cmd_byte, payload, pack_no):
+    # Assembled in one growing bytearray: no intermediate header /
+    # payload / frame concatenations, and the checksum runs over the
+    # same buffer the frame is sent from.
+    buf = bytearray(STX)
+    buf.append(cmd_byte)
+    if cmd_byte not in (CMD_POLL, CMD_ACK):
+        buf.append(1 + len(payload))
+        buf.append(pack_no)
+        buf += payload
+    else:
+        buf.append(0)
+    buf.append(_checksum(buf))
+    return bytes(buf)
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)s | %(message)s')
+# Hot-path logging goes through lazy %s formatting so disabled levels
+# never pay for string construction.
+_log = logging.getLogger(__name__)
+
+class _DBWriteWorker:
+    """
+    Runs DatabaseManager write methods on a background thread so a slow
+    commit (fsync can spike to ~10ms on flash) never eats into the serial
+    protocol's ACK deadlines. Bursts drained together are folded into one
+    transaction via db.batch(). Reads stay synchronous on the caller.
+    """
+
+    def __init__(self, db):
+        self._db = db
+        self._q = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, method, *args):
+        self._q.put((method, args))
+
+    def _run(self):
+        while True:
+            items = [self._q.get()]
+            while len(items) < 32:
+                try:
+                    items.append(self._q.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with self._db.batch():
+                    for method, args in items:
+                        getattr(self._db, method)(*args)
+            except Exception as e:
+                _log.error("DB write batch failed: %s", e)
+
 
 class VMCController:
     def __init__(self):
         self.db = DatabaseManager()
+        self._db_writes = _DBWriteWorker(self.db)
         self.ser = None
+        self._selector = None
         self.current_local_pack_no = 1
         
         # State Tracking
-        self.pending_action_id = None 
+        self.pending_action_id = None
         self.pending_action_type = None
+        # Last command the VMC ACKed. The ACKED status is written
+        # off-thread, so until it lands the queue can still surface that
+        # row — this id is the fence that stops a re-send.
+        self._last_acked_id = None
+
+        # Receive buffer: serial reads drain whatever has arrived and the
+        # framing logic scans/slices this in memory (C-speed bytes.find)
+        # instead of issuing one ser.read(1) per scanned byte.
+        self._rxbuf = bytearray()
         self.waiting_for_ack = False # State flag
         self.last_sent_cmd_data = None # Store to handle retries
 
+        # The ACK frame is a constant (FA FB 42 00 + XOR) written on every
+        # idle heartbeat and after every data packet — build it once.
+        self._ack_packet = bytes(
+            [0xFA, 0xFB, CMD_ACK, 0x00, 0xFA ^ 0xFB ^ CMD_ACK ^ 0x00])
+
+        # One-slot mirror of the head of the SQLite queue, kept warm by a
+        # prefetch thread so the POLL handler usually pops a ready row
+        # instead of paying a SQL round-trip inside the protocol window.
+        # SQLite stays the durable source of truth; the mirror refills
+        # from it and the handler falls back to it when the mirror is dry.
+        self._cmd_cache = deque()
+        threading.Thread(target=self._prefetch_loop, daemon=True).start()
+
+        # Bound-method dispatch table for data commands (see parse_vmc_data).
+        self._parsers = {
+            0x21: self._parse_money,
+            CMD_REPORT_PRODUCT: self._parse_product,
+            0x02: self._parse_selection,
+            0x04: self._parse_dispense,
+            CMD_GENERIC_RETURN: self._parse_generic_return,
+            CMD_MACHINE_STATUS: self._parse_machine_status,
+        }
+
     def connect(self):
         while True:
             try:
                 self.ser = serial.Serial(SERIAL_PORT, BAUD_RATE, 8, 'N', 1, timeout=TIMEOUT)
                 self.ser.reset_input_buffer()
-                logging.info(f"Connected to VMC on {SERIAL_PORT}")
+                self._rxbuf.clear()
+                # Register the port fd once; epoll-backed readiness beats
+                # rebuilding a select() fd set on every fill.
+                if self._selector is not None:
+                    self._selector.close()
+                self._selector = selectors.DefaultSelector()
+                self._selector.register(self.ser.fileno(), selectors.EVENT_READ)
+                _log.info("Connected to VMC on %s", SERIAL_PORT)
                 return
             except Exception as e:
-                logging.error(f"Connection Failed: {e}. Retrying in 5s...")
+                _log.error("Connection Failed: %s. Retrying in 5s...", e)
                 time.sleep(5)
 
     def calculate_checksum(self, data):
-        checksum = 0
-        for byte in data:
-            checksum ^= byte
-        return checksum
+        return _checksum(data)
 
     def build_packet(self, cmd_byte, payload=b'', use_pack_no=None):
-        final_payload = b''
-        length_byte = 0
-        
-        if cmd_byte not in [CMD_POLL, CMD_ACK]:
+        # The VMC command menu is small and pack_no cycles through 255
+        # values, so whole frames repeat constantly — a memoized pure
+        # builder turns repeat construction into a dict hit.
+        if cmd_byte in (CMD_POLL, CMD_ACK):
+            pack_no = 0  # not framed; normalized so the cache key is stable
+        else:
             pack_no = use_pack_no if use_pack_no is not None else self.current_local_pack_no
-            final_payload = struct.pack('B', pack_no) + payload
-            length_byte = len(final_payload)
+        return _build_frame(cmd_byte, bytes(payload), pack_no)
+
+    def _fill_rxbuf(self):
+        """
+        Drains everything the UART driver has buffered into _rxbuf with one
+        os.read, instead of going through pyserial's per-call select+read
+        machinery for each small piece. pyserial keeps the fd non-blocking,
+        so we wait for readability on the registered selector ourselves.
+        """
+        if not self._selector.select(timeout=IDLE_SELECT_TIMEOUT):
+            return False
+        try:
+            chunk = os.read(self.ser.fileno(), 4096)
+        except BlockingIOError:
+            return False
+        if not chunk:
+            return False
+        self._rxbuf += chunk
+        return True
+
+    def _sync_stx(self):
+        """Discards noise up to and including the next STX marker."""
+        buf = self._rxbuf
+        while True:
+            idx = buf.find(STX)
+            if idx >= 0:
+                del buf[:idx + 2]
+                return True
+            # No STX in the buffer: drop all but the last byte (it may be
+            # the FA of a marker split across reads) and wait for more.
+            if len(buf) > 1:
+                del buf[:-1]
+            if not self._fill_rxbuf():
+                return False
 
-        header = STX + struct.pack('BB', cmd_byte, length_byte)
-        data_to_sum = header + final_payload
-        xor = self.calculate_checksum(data_to_sum)
-        return data_to_sum + struct.pack('B', xor)
+    def _take_exact(self, n):
+        """Returns n buffered bytes, reading more as needed; None on timeout."""
+        buf = self._rxbuf
+        while len(buf) < n:
+            if not self._fill_rxbuf():
+                return None
+        out = bytes(buf[:n])
+        del buf[:n]
+        return out
 
     def read_packet(self):
         try:
-            while True:
-                b = self.ser.read(1)
-                if not b: return None
-                if b == b'\xFA':
-                    if self.ser.read(1) == b'\xFB': break
-            
-            header = self.ser.read(2)
-            if len(header) < 2: return None
-            cmd, length = struct.unpack('BB', header)
-            
-            payload = self.ser.read(length) if length > 0 else b''
-            if len(payload) != length: return None
-            
-            checksum = self.ser.read(1)
-            if not checksum: return None
-            
-            raw = STX + header + payload
-            if self.calculate_checksum(raw) == ord(checksum):
-                return {'cmd': cmd, 'payload': payload}
+            if not self._sync_stx():
+                return None
+
+            header = self._take_exact(2)
+            if header is None: return None
+            cmd, length = header[0], header[1]
+
+            # Payload and checksum arrive back-to-back: take them together.
+            rest = self._take_exact(length + 1)
+            if rest is None: return None
+
+            frame = STX + header + rest
+            if self.calculate_checksum(frame[:-1]) == frame[-1]:
+                return {'cmd': cmd, 'payload': rest[:length]}
             return None
         except Exception as e:
-            logging.error(f"Read Error: {e}")
+            _log.error("Read Error: %s", e)
             return None
 
+    # --- Data-command parsers -------------------------------------------
+    # One method per VMC data command; parse_vmc_data dispatches through
+    # self._parsers (O(1) dict lookup instead of an elif chain), and each
+    # handler can be exercised on its own.
+
+    def _parse_money(self, data_body, hex_data):    # 0x21
+        mode, amount = _MONEY_STRUCT.unpack_from(data_body)
+        parsed_info = {"mode": mode, "amount": amount}
+        _log.info("💵 Money In: %s", amount)
+
+    def _parse_product(self, data_body, hex_data):  # 0x11
+        parsed_info = parse_product_report(data_body)
+        if parsed_info: self._db_writes.submit('upsert_product', parsed_info)
+
+    def _parse_selection(self, data_body, hex_data):  # 0x02 Check Selection
+        status_code = data_body[0]
+        parsed_info = {"status_code": status_code, "msg": "Normal" if status_code==1 else "Error"}
+        if self.pending_action_id and self.pending_action_type == 0x03:
+            status = 'ACCEPTED' if status_code == 0x01 else 'FAILED'
+            self._db_writes.submit('update_command_result', self.pending_action_id, status, hex_data, parsed_info)
+
+    def _parse_dispense(self, data_body, hex_data):  # 0x04 Dispense Status
+        status_code = data_body[0]
+        parsed_info = {"code": status_code}
+        is_success = status_code in _DISPENSE_SUCCESS
+        is_intermediate = status_code in _DISPENSE_INTERMEDIATE
+        if self.pending_action_id:
+            if is_intermediate: self._db_writes.submit('update_command_result', self.pending_action_id, 'DISPENSING', hex_data, parsed_info)
+            else: self._db_writes.submit('update_command_result', self.pending_action_id, 'COMPLETED' if is_success else 'FAILED', hex_data, parsed_info)
+
+    def _parse_generic_return(self, data_body, hex_data):  # 0x71
+        parsed_info = parse_0x71_generic(data_body)
+        if self.pending_action_id and parsed_info and parsed_info.sub_command == self.pending_action_type:
+            # success only exists on SetAck; reads count as success.
+            success = getattr(parsed_info, 'success', True)
+            self._db_writes.submit('update_command_result', self.pending_action_id, 'COMPLETED' if success else 'FAILED', hex_data, parsed_info._asdict())
+
+    def _parse_machine_status(self, data_body, hex_data):  # 0x52
+        if len(data_body) < _STATUS_STRUCT.size:
+            self.db.log_event_async("CMD_0x52_SHORT", hex_data)
+            return
+        (bill_acc, coin_acc, card, temp_ctrl, temperature, door,
+         bill_change, coin_change, machine_id) = _STATUS_STRUCT.unpack_from(data_body)
+        machine_id = machine_id.decode('utf-8', errors='ignore').strip('\x00 ')
+        # These are drained as one batch (one transaction) by the worker.
+        self._db_writes.submit('update_machine_status', 'temperature', temperature, hex_data)
+        self._db_writes.submit('update_machine_status', 'door_open', door, hex_data)
+        self._db_writes.submit('update_machine_status', 'bill_change', bill_change, hex_data)
+        self._db_writes.submit('update_machine_status', 'coin_change', coin_change, hex_data)
+        self._db_writes.submit('update_machine_status', 'devices', f"{bill_acc},{coin_acc},{card},{temp_ctrl}", hex_data)
+        self._db_writes.submit('update_machine_status', 'machine_id', machine_id, hex_data)
+
     def parse_vmc_data(self, cmd, payload):
-        hex_data = payload.hex().upper()
+        hex_data = _hex_upper(payload)
         data_body = payload[1:] if len(payload) > 0 else b''
-        parsed_info = {}
-        event_type = f"CMD_{hex(cmd)}"
-
-        # Reuse the parsing logic from previous step...
-        # (Shortened for brevity, assumes full parser logic is here)
-        if cmd == 0x21: # Money
-            parsed_info = {"mode": data_body[0], "amount": int.from_bytes(data_body[1:5], 'big')}
-            logging.info(f"💵 Money In: {parsed_info['amount']}")
-        elif cmd == CMD_REPORT_PRODUCT: # 0x11
-            parsed_info = ResponseParser.parse_product_report(data_body)
-            if parsed_info: self.db.upsert_product(parsed_info)
-        elif cmd == 0x02: # Check Selection
-            status_code = data_body[0]
-            parsed_info = {"status_code": status_code, "msg": "Normal" if status_code==1 else "Error"}
-            if self.pending_action_id and self.pending_action_type == 0x03:
-                status = 'ACCEPTED' if status_code == 0x01 else 'FAILED'
-                self.db.update_command_result(self.pending_action_id, status, hex_data, parsed_info)
-        elif cmd == 0x04: # Dispense Status
-            status_code = data_body[0]
-            parsed_info = {"code": status_code}
-            is_success = status_code in [0x02, 0x24]
-            is_intermediate = status_code in [0x01, 0x10, 0x11, 0x12, 0x13]
-            if self.pending_action_id:
-                if is_intermediate: self.db.update_command_result(self.pending_action_id, 'DISPENSING', hex_data, parsed_info)
-                else: self.db.update_command_result(self.pending_action_id, 'COMPLETED' if is_success else 'FAILED', hex_data, parsed_info)
-        elif cmd == CMD_GENERIC_RETURN: # 0x71
-            parsed_info = ResponseParser.parse_0x71_generic(data_body)
-            if self.pending_action_id and parsed_info and parsed_info.get('sub_command') == self.pending_action_type:
-                self.db.update_command_result(self.pending_action_id, 'COMPLETED' if parsed_info.get('success', True) else 'FAILED', hex_data, parsed_info)
-        elif cmd == CMD_MACHINE_STATUS: # 0x52
-             # ... existing 0x52 logic ...
-             pass
+
+        handler = self._parsers.get(cmd)
+        if handler:
+            handler(data_body, hex_data)
         else:
-            self.db.log_event(event_type, hex_data)
+            self.db.log_event_async(f"CMD_{hex(cmd)}", hex_data)
+
+    # =====================================================================
+    # Protocol step handlers. run() is a thin dispatch loop over these so
+    # each protocol case stays independently readable and replaceable.
+    # =====================================================================
+
+    def _handle_poll(self):
+        """POLL is both the start and the end of a VMC cycle."""
+        # 1. CHECK PREVIOUS CYCLE
+        # If we are seeing a POLL but waiting_for_ack is True, we missed the ACK.
+        if self.waiting_for_ack and self.pending_action_id:
+            _log.warning("Missed ACK for CMD %s. Handling Retry...", self.pending_action_id)
+            # Fetch current retry count to be safe
+            # Note: We just increment here. Next cycle handles re-sending.
+            if self.last_sent_cmd_data:
+                status = self.db.increment_retry(self.pending_action_id, self.last_sent_cmd_data['retry_count'])
+                if status == 'FAILED':
+                    _log.error("CMD %s Failed Max Retries", self.pending_action_id)
+                    self.pending_action_id = None
+                    self.pending_action_type = None
+                    self.last_sent_cmd_data = None
+                # If status is SENDING, we keep pending_action_id.
+                # Next block will pick it up because DB status is SENDING.
+
+        # 2. CLEAR CONTEXT (Poll terminates transaction data stream)
+        self.waiting_for_ack = False
+        # Note: We DO NOT clear pending_action_id here blindly,
+        # because we might be in the middle of a multi-stage dispense (waiting for 0x04 status).
+        # We only clear it if we were expecting an ACK (transport layer) and finished that step.
+
+        # 3. FETCH NEXT ACTION (prefetched copy when available)
+        next_cmd = self._cmd_cache.popleft() if self._cmd_cache else None
+        if next_cmd is not None and (next_cmd['id'] == self.pending_action_id
+                                     or next_cmd['id'] == self._last_acked_id):
+            # The mirror raced a send and cached the in-flight row; drop
+            # it and ask the queue directly.
+            next_cmd = None
+        if next_cmd is None:
+            next_cmd = self.db.get_next_command()
+        if next_cmd is not None and next_cmd['id'] == self._last_acked_id:
+            # Already delivered — the async ACKED write just has not
+            # landed yet. Idle this cycle rather than double-send.
+            next_cmd = None
+
+        if next_cmd:
+            cmd_id = next_cmd['id']
+            # Pre-decoded by add_command; hex fallback covers rows written
+            # before the command_bytes column existed.
+            raw_bytes = next_cmd['command_bytes'] or bytes.fromhex(next_cmd['command_hex'])
+
+            # Logic: New vs Retry
+            is_new = (next_cmd['status'] == 'PENDING')
+            pack_no = self.current_local_pack_no if is_new else next_cmd['assigned_pack_no']
+
+            if is_new:
+                self.db.mark_as_sending(cmd_id, pack_no)
+
+            # Send Command
+            packet = self.build_packet(raw_bytes[0], raw_bytes[1:], use_pack_no=pack_no)
+            self.ser.write(packet)
+
+            # Update State
+            self.pending_action_id = cmd_id
+            self.pending_action_type = raw_bytes[0]
+            self.last_sent_cmd_data = next_cmd
+            self.waiting_for_ack = True # Non-blocking wait
+            # Anything mirrored before this send may now be stale.
+            self._cmd_cache.clear()
+
+            # NO NESTED READ HERE! We loop back.
+
+        else:
+            # Idle Heartbeat
+            self.ser.write(self._ack_packet)
+
+    def _prefetch_loop(self):
+        """Keeps _cmd_cache holding the current head of the command queue."""
+        while True:
+            if not self._cmd_cache:
+                try:
+                    row = self.db.get_next_command()
+                except Exception as e:
+                    _log.error("Queue prefetch failed: %s", e)
+                    row = None
+                # Mirror only idle PENDING rows: a SENDING row (or the
+                # current in-flight id) is mid-conversation and must come
+                # from the queue itself, never a cached copy.
+                if (row is not None and row['status'] == 'PENDING'
+                        and row['id'] != self.pending_action_id):
+                    self._cmd_cache.append(row)
+            time.sleep(QUEUE_PREFETCH_INTERVAL)
+
+    def _handle_ack(self):
+        """Receipt confirmation for the command we last sent."""
+        if self.waiting_for_ack:
+            # Successful Transport (durable update happens off-thread)
+            self._db_writes.submit('update_command_result', self.pending_action_id, 'ACKED')
+            self._last_acked_id = self.pending_action_id
+            self.waiting_for_ack = False
+            self.current_local_pack_no = (self.current_local_pack_no % 255) + 1
+            _log.info("ACK Received for CMD %s", self.pending_action_id)
+        else:
+            _log.debug("Received stray ACK (Ignored)")
+
+    def _handle_data(self, cmd, payload):
+        """Responses and unsolicited events."""
+        # Writes fan out through _db_writes, which batches them into one
+        # transaction off-thread — parsing itself never blocks on a commit.
+        self.parse_vmc_data(cmd, payload)
+
+        # Protocol says we must ACK data
+        self.ser.write(self._ack_packet)
 
     def run(self):
         self.connect()
-        logging.info("Daemon Running (Non-Blocking Mode)...")
-        
+        _log.info("Daemon Running (Non-Blocking Mode)...")
+
         while True:
             packet = self.read_packet()
-            
+
             if not packet:
                 continue
 
             cmd = packet['cmd']
-
-            # =================================================================
-            # CASE 1: POLL (The Start AND End of a Cycle)
-            # =================================================================
             if cmd == CMD_POLL:
-                
-                # 1. CHECK PREVIOUS CYCLE
-                # If we are seeing a POLL but waiting_for_ack is True, we missed the ACK.
-                if self.waiting_for_ack and self.pending_action_id:
-                    logging.warning(f"Missed ACK for CMD {self.pending_action_id}. Handling Retry...")
-                    # Fetch current retry count to be safe
-                    # Note: We just increment here. Next cycle handles re-sending.
-                    if self.last_sent_cmd_data:
-                        status = self.db.increment_retry(self.pending_action_id, self.last_sent_cmd_data['retry_count'])
-                        if status == 'FAILED':
-                            logging.error(f"CMD {self.pending_action_id} Failed Max Retries")
-                            self.pending_action_id = None
-                            self.pending_action_type = None
-                            self.last_sent_cmd_data = None
-                        # If status is SENDING, we keep pending_action_id. 
-                        # Next block will pick it up because DB status is SENDING.
-
-                # 2. CLEAR CONTEXT (Poll terminates transaction data stream)
-                self.waiting_for_ack = False
-                # Note: We DO NOT clear pending_action_id here blindly, 
-                # because we might be in the middle of a multi-stage dispense (waiting for 0x04 status).
-                # We only clear it if we were expecting an ACK (transport layer) and finished that step.
-
-                # 3. FETCH NEXT ACTION
-                next_cmd = self.db.get_next_command()
-                
-                if next_cmd:
-                    cmd_id = next_cmd['id']
-                    raw_bytes = bytes.fromhex(next_cmd['command_hex'])
-                    
-                    # Logic: New vs Retry
-                    is_new = (next_cmd['status'] == 'PENDING')
-                    pack_no = self.current_local_pack_no if is_new else next_cmd['assigned_pack_no']
-                    
-                    if is_new: 
-                        self.db.mark_as_sending(cmd_id, pack_no)
-
-                    # Send Command
-                    packet = self.build_packet(raw_bytes[0], raw_bytes[1:], use_pack_no=pack_no)
-                    self.ser.write(packet)
-                    
-                    # Update State
-                    self.pending_action_id = cmd_id
-                    self.pending_action_type = raw_bytes[0]
-                    self.last_sent_cmd_data = next_cmd
-                    self.waiting_for_ack = True # Non-blocking wait
-                    
-                    # NO NESTED READ HERE! We loop back.
-                    
-                else:
-                    # Idle Heartbeat
-                    self.ser.write(self.build_packet(CMD_ACK))
-
-            # =================================================================
-            # CASE 2: ACK (Receipt Confirmation)
-            # =================================================================
+                self._handle_poll()
             elif cmd == CMD_ACK:
-                if self.waiting_for_ack:
-                    # Successful Transport
-                    self.db.update_command_result(self.pending_action_id, 'ACKED')
-                    self.waiting_for_ack = False
-                    self.current_local_pack_no = (self.current_local_pack_no % 255) + 1
-                    logging.info(f"ACK Received for CMD {self.pending_action_id}")
-                else:
-                    logging.debug("Received stray ACK (Ignored)")
-
-            # =================================================================
-            # CASE 3: DATA (Responses & Events)
-            # =================================================================
+                self._handle_ack()
             else:
-                # Process data immediately
-                self.parse_vmc_data(cmd, packet['payload'])
-                
-                # Protocol says we must ACK data
-                self.ser.write(self.build_packet(CMD_ACK))
+                self._handle_data(cmd, packet['payload'])
 
 if __name__ == "__main__":
     ctrl = VMCController()
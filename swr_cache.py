@@ -0,0 +1,63 @@
+import threading
+import time
+
+
+class SWRCache:
+    """
+    Tiny stale-while-revalidate cache for rendered response bodies.
+
+    Entries are fresh for `fresh_ttl` seconds and may be served stale for up
+    to `stale_ttl` seconds while a single background thread rebuilds them.
+    A version number (bumped by the DB layer on writes) forces an early
+    rebuild for in-process writes without waiting out the TTL.
+    """
+
+    def __init__(self, fresh_ttl=1.0, stale_ttl=10.0):
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = stale_ttl
+        self._lock = threading.Lock()
+        self._entries = {}       # key -> (body, built_at, version)
+        self._refreshing = set()
+
+    def get(self, key, builder, version=0):
+        """
+        Returns the cached body for `key`, rebuilding via `builder()` when
+        missing or expired. A stale-but-serveable entry is returned
+        immediately while a background thread refreshes it.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+
+        if entry:
+            body, built_at, built_version = entry
+            age = now - built_at
+            if age < self.fresh_ttl and built_version == version:
+                return body
+            if age < self.stale_ttl:
+                self._refresh_in_background(key, builder, version)
+                return body
+
+        return self._rebuild(key, builder, version)
+
+    def _refresh_in_background(self, key, builder, version):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        threading.Thread(
+            target=self._background_rebuild, args=(key, builder, version), daemon=True
+        ).start()
+
+    def _background_rebuild(self, key, builder, version):
+        try:
+            self._rebuild(key, builder, version)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _rebuild(self, key, builder, version):
+        body = builder()
+        with self._lock:
+            self._entries[key] = (body, time.time(), version)
+        return body
@@ -1,9 +1,15 @@
-import struct
-
 """
 VMC Protocol V3.0 Command Library
 ---------------------------------
+
+The single canonical copy of the command builders and response parsers;
+both the API and the serial daemon import from here. Extend this module
+rather than forking a trimmed copy next to a caller.
 """
+import struct
+import threading
+from functools import lru_cache
+from typing import Callable, NamedTuple, Union
 
 # --- Command Constants ---
 CMD_CHECK_SELECTION = 0x01
@@ -20,108 +26,402 @@ CMD_INFO_SYNC       = 0x31
 CMD_QUERY_STATUS    = 0x51
 CMD_DEDUCT_MONEY    = 0x64
 
+# --- Compiled packet shapes ---
+# struct.pack/unpack with a literal format reparses it on every call;
+# module-level Struct singletons compile each shape once.
+_DISPENSE   = struct.Struct('>BH')   # cmd + selection
+_DEDUCT     = struct.Struct('>BI')   # cmd + amount
+_SETPRICE   = struct.Struct('>BHI')  # cmd + selection + price
+_SETINVCAP  = struct.Struct('>BHB')  # cmd + selection + count
+_QCFG       = struct.Struct('>BH')   # cmd + selection
+_QSALES     = struct.Struct('>BI')   # cmd + date
+_BYTE       = struct.Struct('B')     # bare command byte
+_PRODREPORT = struct.Struct('>HIBBHB')   # 0x11 body
+_CFG42      = struct.Struct('>IBBHBBBB') # 0x71/0x42 config body
+_SALES43    = struct.Struct('>II')       # 0x71/0x43 sales totals
+
+# bytes.hex() emits lowercase and .upper() re-walks the result; one
+# C-level translate pass uppercases the six letters instead.
+_HEX_UPPER_TBL = bytes.maketrans(b'abcdef', b'ABCDEF')
+
+def _to_hex(buf: Union[bytes, bytearray, memoryview]) -> str:
+    return buf.hex().encode('ascii').translate(_HEX_UPPER_TBL).decode('ascii')
+
+# --- Raw frame emission ---
+# The hex strings exist for DB storage; when a caller already has the
+# serial port in hand, build_frame emits the fully framed packet
+# (STX + cmd + len + pack_no + body + XOR) in one pass, skipping the
+# hex-encode / bytes.fromhex / reframe round trip entirely.
+_STX = b'\xFA\xFB'
+
+# Body-only shapes for pack_into-style frame assembly.
+_SEL_BODY = struct.Struct('>H')
+_AMT_BODY = struct.Struct('>I')
+
+def _xor_fold(data: Union[bytes, bytearray, memoryview]) -> int:
+    # Same halving XOR fold the serial daemon uses for checksums.
+    n = len(data)
+    acc = int.from_bytes(data, 'little')
+    while n > 1:
+        h = (n + 1) >> 1
+        acc = (acc >> (h << 3)) ^ (acc & ((1 << (h << 3)) - 1))
+        n = h
+    return acc & 0xFF
+
+def _frame_buf(cmd_byte: int, pack_no: int, body_size: int) -> bytearray:
+    buf = bytearray(6 + body_size)
+    buf[0:2] = _STX
+    buf[2] = cmd_byte
+    buf[3] = 1 + body_size
+    buf[4] = pack_no
+    return buf
+
+def _finish_frame(buf: bytearray) -> bytes:
+    buf[-1] = _xor_fold(memoryview(buf)[:-1])
+    return bytes(buf)
+
+def build_frame(command_bytes: bytes, pack_no: int = 1) -> bytes:
+    """
+    Frames an already-packed command (cmd byte + args, the same bytes the
+    hex strings encode) for the wire.
+    """
+    body = command_bytes[1:]
+    buf = _frame_buf(command_bytes[0], pack_no, len(body))
+    buf[5:5 + len(body)] = body
+    return _finish_frame(buf)
+
+# Constant commands folded at import — the hex of a bare command byte (or
+# a fixed zero payload) is known statically, so these are plain f-strings
+# over the constants rather than pack+hex round trips. Per-selection
+# commands come from a small lru_cache (the selection space is a closed
+# set of slots), so a repeat build is a dict hit instead of pack+hex.
+_SYNC_INFO_HEX = f'{CMD_INFO_SYNC:02X}'
+_QUERY_STATUS_HEX = f'{CMD_QUERY_STATUS:02X}'
+_CANCEL_HEX = f'{CMD_DEDUCT_MONEY:02X}' + '00' * _AMT_BODY.size  # deduct of 0
+
+# --- Optional precomputed hex tables ---
+# With the tables enabled, a 2-byte field's hex is one tuple index instead
+# of a format call, and 4-byte fields compose two halves. _HEX4 retains a
+# few MB of small strings, so embedded deployments opt in explicitly via
+# enable_hex_tables(); until then _hex_u16 falls back to f-string
+# formatting with identical output.
+_HEX2 = tuple(f'{i:02X}' for i in range(256))
+_HEX4: 'Union[tuple, None]' = None
+
+_DISPENSE_PREFIX = _HEX2[CMD_DISPENSE]
+_QCFG_PREFIX = _HEX2[CMD_QUERY_CONFIG]
+_DEDUCT_PREFIX = _HEX2[CMD_DEDUCT_MONEY]
+
+def _hex_u16(value: int) -> str:
+    if _HEX4 is not None:
+        return _HEX4[value & 0xFFFF]
+    return f'{value & 0xFFFF:04X}'
+
+def _deduct_card_table(amount: int) -> str:
+    """0x64 + amount — table fast path installed by enable_hex_tables()."""
+    amount &= 0xFFFFFFFF
+    return _DEDUCT_PREFIX + _HEX4[amount >> 16] + _HEX4[amount & 0xFFFF]
+
+def enable_hex_tables() -> None:
+    """
+    Builds the 65,536-entry uint16→4-char table and switches deduct_card
+    (unbounded amount space, so the lru_cache cannot help it) to hex-table
+    composition. Idempotent; call once at startup where the memory cost is
+    acceptable.
+    """
+    global _HEX4
+    if _HEX4 is not None:
+        return
+    _HEX4 = tuple(f'{i:04X}' for i in range(65536))
+    globals()['deduct_card'] = _deduct_card_table
+    CommandBuilder.deduct_card = staticmethod(_deduct_card_table)
+
+@lru_cache(maxsize=256)
+def _dispense_hex(selection_id: int) -> str:
+    return _DISPENSE_PREFIX + _hex_u16(selection_id)
+
+@lru_cache(maxsize=256)
+def _query_config_hex(selection_id: int) -> str:
+    return _QCFG_PREFIX + _hex_u16(selection_id)
+
+# --- Command builders ---
+# Module-level functions; CommandBuilder below is a thin shim over them.
+# Hot callers can `from vmc_commands import dispense` and skip the
+# class-attribute (staticmethod descriptor) lookup per call.
+
+def dispense(selection_id: int) -> str:
+    return _dispense_hex(selection_id)
+
+def dispense_bytes(selection_id: int) -> bytes:
+    return _DISPENSE.pack(CMD_DISPENSE, _u16(selection_id))
+
+def query_selection_config_bytes(selection_id: int) -> bytes:
+    return _QCFG.pack(CMD_QUERY_CONFIG, _u16(selection_id))
+
+def cancel_transaction() -> str:
+    return _CANCEL_HEX
+
+def sync_info() -> str:
+    return _SYNC_INFO_HEX
+
+def query_machine_status() -> str:
+    return _QUERY_STATUS_HEX
+
+# --- FRAME VARIANTS (raw bytes for direct sends) ---
+
+def dispense_frame(selection_id: int, pack_no: int = 1) -> bytes:
+    buf = _frame_buf(CMD_DISPENSE, pack_no, _SEL_BODY.size)
+    _SEL_BODY.pack_into(buf, 5, selection_id)
+    return _finish_frame(buf)
+
+def deduct_card_frame(amount: int, pack_no: int = 1) -> bytes:
+    buf = _frame_buf(CMD_DEDUCT_MONEY, pack_no, _AMT_BODY.size)
+    _AMT_BODY.pack_into(buf, 5, amount)
+    return _finish_frame(buf)
+
+def query_selection_config_frame(selection_id: int, pack_no: int = 1) -> bytes:
+    buf = _frame_buf(CMD_QUERY_CONFIG, pack_no, _SEL_BODY.size)
+    _SEL_BODY.pack_into(buf, 5, selection_id)
+    return _finish_frame(buf)
+
+# --- SET COMMANDS ---
+# deduct_card and the set_* builders are generated from _CMDS below:
+# same constant-cmd + fixed-shape pattern, declared once.
+
+# --- QUERY COMMANDS ---
+
+def query_selection_config(selection_id: int) -> str:
+    # 0x42 + Selection(2)
+    return _query_config_hex(selection_id)
+
+def query_daily_sales_int(date_int: int) -> str:
+    # 0x43 + YYYYMMDD as an integer — fast path for pre-validated dates.
+    return _to_hex(_QSALES.pack(CMD_QUERY_SALES, date_int))
+
+def query_daily_sales(date_str: str) -> Union[str, None]:
+    # 0x43 + YYYYMMDD (4 bytes BCD or ASCII? PDF says 4 byte. Usually compressed BCD or Int)
+    # Assuming Integer YYYYMMDD for now based on standard VMC protocols
+    # Validate up front instead of a bare try/except (which also
+    # swallowed KeyboardInterrupt).
+    if not (isinstance(date_str, str) and len(date_str) == 8 and date_str.isdigit()):
+        return None
+    return query_daily_sales_int(int(date_str)) # Expects "20231027"
+
+
 class CommandBuilder:
-    @staticmethod
-    def dispense(selection_id):
-        return struct.pack('>BH', CMD_DISPENSE, selection_id).hex().upper()
-
-    @staticmethod
-    def deduct_card(amount):
-        return struct.pack('>BI', CMD_DEDUCT_MONEY, amount).hex().upper()
-
-    @staticmethod
-    def cancel_transaction():
-        return CommandBuilder.deduct_card(0)
-
-    @staticmethod
-    def sync_info():
-        return struct.pack('B', CMD_INFO_SYNC).hex().upper()
-
-    @staticmethod
-    def query_machine_status():
-        return struct.pack('B', CMD_QUERY_STATUS).hex().upper()
-
-    # --- SET COMMANDS ---
-    
-    @staticmethod
-    def set_price(selection_id, price):
-        # 0x12 + Selection(2) + Price(4)
-        return struct.pack('>BHI', CMD_SET_PRICE, selection_id, price).hex().upper()
-
-    @staticmethod
-    def set_inventory(selection_id, inventory):
-        # 0x13 + Selection(2) + Inventory(1)
-        return struct.pack('>BHB', CMD_SET_INVENTORY, selection_id, inventory).hex().upper()
-
-    @staticmethod
-    def set_capacity(selection_id, capacity):
-        # 0x14 + Selection(2) + Capacity(1)
-        return struct.pack('>BHB', CMD_SET_CAPACITY, selection_id, capacity).hex().upper()
-
-    # --- QUERY COMMANDS ---
-
-    @staticmethod
-    def query_selection_config(selection_id):
-        # 0x42 + Selection(2)
-        return struct.pack('>BH', CMD_QUERY_CONFIG, selection_id).hex().upper()
-
-    @staticmethod
-    def query_daily_sales(date_str):
-        # 0x43 + YYYYMMDD (4 bytes BCD or ASCII? PDF says 4 byte. Usually compressed BCD or Int)
-        # Assuming Integer YYYYMMDD for now based on standard VMC protocols
-        try:
-            date_int = int(date_str) # Expects "20231027"
-            return struct.pack('>BI', CMD_QUERY_SALES, date_int).hex().upper()
-        except:
-            return None
+    """
+    Compatibility shim over the module-level builders — existing
+    ``CommandBuilder.x(...)`` call sites keep working. The generated
+    deduct_card/set_* builders are attached by the codegen loop below.
+    """
+    dispense = staticmethod(dispense)
+    dispense_bytes = staticmethod(dispense_bytes)
+    query_selection_config_bytes = staticmethod(query_selection_config_bytes)
+    cancel_transaction = staticmethod(cancel_transaction)
+    sync_info = staticmethod(sync_info)
+    query_machine_status = staticmethod(query_machine_status)
+    dispense_frame = staticmethod(dispense_frame)
+    deduct_card_frame = staticmethod(deduct_card_frame)
+    query_selection_config_frame = staticmethod(query_selection_config_frame)
+    query_selection_config = staticmethod(query_selection_config)
+    query_daily_sales_int = staticmethod(query_daily_sales_int)
+    query_daily_sales = staticmethod(query_daily_sales)
+
+# Declarative builder spec: (name, cmd byte, wire shape, arg names).
+# Every fixed-shape command is one row here; the loop below emits a tight
+# closure over a pre-compiled Struct, so a new command cannot forget the
+# compile-once / single-pass-hex treatment. Memoized (dispense,
+# query_selection_config), constant, and validated (query_daily_sales)
+# builders stay hand-written above.
+_CMDS = (
+    ('deduct_card',    CMD_DEDUCT_MONEY,   '>BI',  ('amount',)),
+    ('set_price',      CMD_SET_PRICE,      '>BHI', ('selection_id', 'price')),
+    ('set_inventory',  CMD_SET_INVENTORY,  '>BHB', ('selection_id', 'inventory')),
+    ('set_capacity',   CMD_SET_CAPACITY,   '>BHB', ('selection_id', 'capacity')),
+    ('set_product_id', CMD_SET_PRODUCT_ID, '>BHH', ('selection_id', 'product_id')),
+)
+
+# Reusable per-thread scratch for builders whose packed bytes are consumed
+# immediately (hex encoding): pack_into the scratch and hex straight off a
+# memoryview, so no transient bytes object is allocated per call.
+_TLS = threading.local()
+
+# Wire-contract field widths. Masking up front is one AND per argument and
+# documents each field's range, instead of letting an oversized int raise
+# struct.error deep in C at pack time.
+def _u8(x: int) -> int:
+    return x & 0xFF
+
+def _u16(x: int) -> int:
+    return x & 0xFFFF
+
+def _u32(x: int) -> int:
+    return x & 0xFFFFFFFF
+
+_FMT_MASKS = {'B': 0xFF, 'H': 0xFFFF, 'I': 0xFFFFFFFF}
+
+def _scratch(n: int) -> bytearray:
+    buf = getattr(_TLS, 'buf', None)
+    if buf is None or len(buf) < n:
+        buf = _TLS.buf = bytearray(max(n, 64))
+    return buf
+
+def _make_builder(name: str, cmd_byte: int, fmt: str,
+                  arg_names: 'tuple[str, ...]'
+                  ) -> 'tuple[Callable[..., str], Callable[..., bytes]]':
+    # Each spec row yields a raw-bytes builder and a hex wrapper over it:
+    # in-process consumers take the packed bytes straight, the hex form
+    # exists for DB storage only.
+    s = struct.Struct(fmt)
+    # Masks for the argument fields, derived from the format (fmt[0] is
+    # the byte-order mark, fmt[1] the command byte).
+    masks = tuple(_FMT_MASKS[c] for c in fmt[2:])
+    def build_bytes(*args: int) -> bytes:
+        return s.pack(cmd_byte, *map(int.__and__, args, masks))
+    def build(*args: int) -> str:
+        buf = _scratch(s.size)
+        s.pack_into(buf, 0, cmd_byte, *map(int.__and__, args, masks))
+        return _to_hex(memoryview(buf)[:s.size])
+    doc = f'0x{cmd_byte:02X} + {" + ".join(arg_names)}'
+    for fn, fn_name in ((build_bytes, name + '_bytes'), (build, name)):
+        fn.__name__ = fn_name
+        fn.__qualname__ = fn_name
+        fn.__doc__ = doc
+    return build, build_bytes
+
+for _spec in _CMDS:
+    _hexfn, _bytesfn = _make_builder(*_spec)
+    globals()[_spec[0]] = _hexfn
+    globals()[_spec[0] + '_bytes'] = _bytesfn
+    setattr(CommandBuilder, _spec[0], staticmethod(_hexfn))
+    setattr(CommandBuilder, _spec[0] + '_bytes', staticmethod(_bytesfn))
+del _spec, _hexfn, _bytesfn
+
+
+class ProductReport(NamedTuple):
+    """Decoded 0x11 slot report — one flat allocation instead of a dict."""
+    selection: int
+    price: int
+    inventory: int
+    capacity: int
+    product_id: int
+    status: int
+
+
+# 0x71 results: one flat NamedTuple per sub-command variant instead of
+# nested dicts — fewer heap objects per frame, and consumers discriminate
+# by type (or duck-type on the shared sub_command/op_type prefix).
+
+class Generic71(NamedTuple):
+    """Unrecognized or payload-less 0x71 return."""
+    sub_command: int
+    op_type: int
+
+class SetAck(NamedTuple):
+    """Setter confirmation (0x12-0x15)."""
+    sub_command: int
+    op_type: int
+    success: bool
+    message: str
+
+class Config71(NamedTuple):
+    """0x42 slot-config read-back."""
+    sub_command: int
+    op_type: int
+    price: int
+    inventory: int
+    capacity: int
+    product_id: int
+    motor_mode: int
+
+class Sales71(NamedTuple):
+    """0x43 daily-sales totals."""
+    sub_command: int
+    op_type: int
+    total_sales_count: int
+    total_revenue: int
+
+# Every shape parse_0x71_generic can return.
+Result71 = Union[Generic71, SetAck, Config71, Sales71]
+
+
+def parse_product_report(data_body: bytes) -> Union[ProductReport, None]:
+    # Parses 0x11
+    if len(data_body) < _PRODREPORT.size: return None
+    return ProductReport._make(_PRODREPORT.unpack_from(data_body))
+
+def parse_product_report_stream(data_body: Union[bytes, memoryview]) -> 'list[ProductReport]':
+    """
+    Parses a run of back-to-back 0x11 records (the sync_info burst) in
+    one C-level iter_unpack pass — no per-record slicing or dispatch.
+    Trailing bytes short of a full record are ignored.
+    """
+    mv = memoryview(data_body)
+    usable = len(mv) - (len(mv) % _PRODREPORT.size)
+    return [ProductReport._make(t) for t in _PRODREPORT.iter_unpack(mv[:usable])]
+
+def parse_0x71_generic(data_body: Union[bytes, memoryview]) -> Union['Result71', None]:
+    """
+    Parses the multi-purpose 0x71 return command.
+    Structure: [SubCmd] [OpType] [Data...]
+    """
+    if len(data_body) < 3: return None
+
+    # Dispatch first: heartbeat and other unrecognized sub-commands are a
+    # large share of 0x71 traffic on some machines, and there is nothing
+    # to hand back for them — return None without allocating a result
+    # (callers already guard for None, as with parse_product_report).
+    handler = _0X71_HANDLERS.get(data_body[0])
+    if handler is None:
+        return None
+
+    if not isinstance(data_body, memoryview):
+        data_body = memoryview(data_body)
+    # op_type: 0x00=Read Success, 0x01=Set Success/Fail usually.
+    # Handlers read past the 2-byte prefix via unpack_from — no slice.
+    return handler(data_body, data_body[1], data_body[0])
+
 
 class ResponseParser:
-    @staticmethod
-    def parse_product_report(data_body):
-        # Parses 0x11
-        if len(data_body) < 11: return None
-        sel, price, inv, cap, pid, status = struct.unpack('>HIBBHB', data_body[:11])
-        return {
-            "selection": sel, "price": price, "inventory": inv,
-            "capacity": cap, "product_id": pid, "status": status
-        }
-
-    @staticmethod
-    def parse_0x71_generic(data_body):
-        """
-        Parses the multi-purpose 0x71 return command.
-        Structure: [SubCmd] [OpType] [Data...]
-        """
-        if len(data_body) < 3: return None
-        
-        sub_cmd = data_body[0]
-        op_type = data_body[1] # 0x00=Read Success, 0x01=Set Success/Fail usually
-        payload = data_body[2:]
-        
-        result = {"sub_command": sub_cmd, "op_type": op_type}
-
-        # 1. SET CONFIRMATION (Price, Inv, etc.)
-        # Usually OpType 0x01, Status 0x00=Success
-        if sub_cmd in [0x12, 0x13, 0x14, 0x15]:
-            status = payload[0] if len(payload) > 0 else 0xFF
-            result["success"] = (status == 0x00)
-            result["message"] = "Set Success" if status == 0x00 else "Set Failed"
-
-        # 2. QUERY CONFIG (0x42 response)
-        elif sub_cmd == 0x42 and op_type == 0x00:
-            # Format: Price(4)+Inv(1)+Cap(1)+PID(2)+Mode(1)+Drop(1)+Jam(1)+Turn(1)
-            if len(payload) >= 12:
-                price, inv, cap, pid, mode, drop, jam, turn = struct.unpack('>IBBHBBBB', payload[:12])
-                result["data"] = {
-                    "price": price, "inventory": inv, "capacity": cap,
-                    "product_id": pid, "motor_mode": mode
-                }
-
-        # 3. QUERY SALES (0x43 response)
-        elif sub_cmd == 0x43 and op_type == 0x00:
-            # Huge struct. Let's grab just Total Count(4) + Total Amt(4)
-            if len(payload) >= 8:
-                total_count, total_amt = struct.unpack('>II', payload[:8])
-                result["data"] = {"total_sales_count": total_count, "total_revenue": total_amt}
-
-        return result
\ No newline at end of file
+    """Compatibility shim over the module-level parsers."""
+    parse_product_report = staticmethod(parse_product_report)
+    parse_product_report_stream = staticmethod(parse_product_report_stream)
+    parse_0x71_generic = staticmethod(parse_0x71_generic)
+
+
+# --- 0x71 sub-command handlers ---
+# Hoisted to module level and dispatched through a dict: O(1) lookup with
+# no per-call list literal, and each handler is one compiled unpack.
+# Handlers receive the full body and read past the 2-byte sub-cmd/op-type
+# prefix with unpack_from offsets — zero slice copies per frame.
+
+def _handle_set_ack(data_body: memoryview, op_type: int, sub_cmd: int) -> SetAck:
+    # SET CONFIRMATION (Price, Inv, etc.)
+    # Usually OpType 0x01, Status 0x00=Success
+    status = data_body[2] if len(data_body) > 2 else 0xFF
+    ok = (status == 0x00)
+    return SetAck(sub_cmd, op_type, ok, "Set Success" if ok else "Set Failed")
+
+def _handle_query_cfg(data_body: memoryview, op_type: int, sub_cmd: int) -> Union[Config71, Generic71]:
+    # QUERY CONFIG (0x42 response)
+    # Format: Price(4)+Inv(1)+Cap(1)+PID(2)+Mode(1)+Drop(1)+Jam(1)+Turn(1)
+    if op_type == 0x00 and len(data_body) >= 2 + _CFG42.size:
+        price, inv, cap, pid, mode = _CFG42.unpack_from(data_body, 2)[:5]
+        return Config71(sub_cmd, op_type, price, inv, cap, pid, mode)
+    return Generic71(sub_cmd, op_type)
+
+def _handle_query_sales(data_body: memoryview, op_type: int, sub_cmd: int) -> Union[Sales71, Generic71]:
+    # QUERY SALES (0x43 response)
+    # Huge struct. Let's grab just Total Count(4) + Total Amt(4)
+    if op_type == 0x00 and len(data_body) >= 2 + _SALES43.size:
+        total_count, total_amt = _SALES43.unpack_from(data_body, 2)
+        return Sales71(sub_cmd, op_type, total_count, total_amt)
+    return Generic71(sub_cmd, op_type)
+
+# Setter commands all acknowledge through the same status-byte shape.
+_SET_ACK_CMDS = frozenset((CMD_SET_PRICE, CMD_SET_INVENTORY,
+                           CMD_SET_CAPACITY, CMD_SET_PRODUCT_ID))
+
+_0X71_HANDLERS = {cmd: _handle_set_ack for cmd in _SET_ACK_CMDS}
+_0X71_HANDLERS[CMD_QUERY_CONFIG] = _handle_query_cfg
+_0X71_HANDLERS[CMD_QUERY_SALES] = _handle_query_sales
\ No newline at end of file